@@ -0,0 +1,126 @@
+import hashlib
+import json
+import re
+from collections import OrderedDict
+from functools import lru_cache
+
+import networkx as nx
+
+GML_PATTERN = re.compile(r"graph\s*\[", re.IGNORECASE)
+DOT_PATTERN = re.compile(r"(strict\s+)?(di)?graph\b[^{]*\{", re.IGNORECASE)
+# Comments and GML header keys such as `Creator "yEd"` that tools write before
+# the graph itself
+HEADER_PATTERN = re.compile(
+    r"""(?:\s+|//[^\n]*|/\*.*?\*/|\#[^\n]*
+    |(?!(?:strict|graph|digraph)\b)[A-Za-z_]\w*\s+(?:"[^"]*"|[-+]?[\d.]+(?:[eE][-+]?\d+)?))*""",
+    re.DOTALL | re.IGNORECASE | re.VERBOSE,
+)
+
+# Identified estimands keyed by graph hash, treatment, outcome and the graph
+# nodes present in the data (dowhy treats the rest as unobserved). Switching
+# estimators, confounders or refuters reuses them instead of re-identifying.
+IDENTIFICATION_CACHE_SIZE = 32
+_identification_cache = OrderedDict()
+
+
+def _canonical_graph(graph):
+    # Keep only structure so that styling attributes don't change the hash
+    canonical = nx.DiGraph()
+    canonical.add_nodes_from(str(node) for node in graph.nodes)
+    canonical.add_edges_from((str(u), str(v)) for u, v in graph.edges)
+    return canonical
+
+
+def _parse_dot(graph_str):
+    import pydot
+
+    try:
+        dot_graphs = pydot.graph_from_dot_data(graph_str)
+    except Exception as e:
+        raise ValueError(f"Could not parse the DOT graph: {e}")
+    if not dot_graphs:
+        raise ValueError("Could not parse the DOT graph.")
+    graph = nx.drawing.nx_pydot.from_pydot(dot_graphs[0])
+    if not graph.is_directed():
+        raise ValueError("The causal graph must be directed (use 'digraph').")
+    return graph
+
+
+def _parse_gml(graph_str):
+    try:
+        graph = nx.parse_gml(graph_str, label="label")
+    except nx.NetworkXError as e:
+        raise ValueError(f"Could not parse the GML graph: {e}")
+    if not graph.is_directed():
+        raise ValueError("The causal graph must be directed (set 'directed 1').")
+    return graph
+
+
+def graph_hash(graph):
+    payload = json.dumps(
+        {
+            "nodes": sorted(graph.nodes),
+            "edges": sorted([u, v] for u, v in graph.edges),
+        }
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=32)
+def load_graph(graph_str):
+    """Parse a DOT or GML string into a DAG and return it with its hash."""
+    body = graph_str[HEADER_PATTERN.match(graph_str).end():]
+    if GML_PATTERN.match(body):
+        graph = _parse_gml(graph_str)
+    elif DOT_PATTERN.match(body):
+        graph = _parse_dot(graph_str)
+    else:
+        raise ValueError("Unrecognised graph format. Expected DOT or GML.")
+    graph = _canonical_graph(graph)
+    if graph.number_of_nodes() == 0:
+        raise ValueError("The causal graph has no nodes.")
+    if not nx.is_directed_acyclic_graph(graph):
+        cycle = " -> ".join(u for u, _ in nx.find_cycle(graph))
+        raise ValueError(f"The causal graph contains a cycle: {cycle}")
+    return graph, graph_hash(graph)
+
+
+def graph_from_common_causes(treatment, outcome, common_causes):
+    graph = nx.DiGraph()
+    graph.add_nodes_from(treatment + outcome + common_causes)
+    graph.add_edges_from((t, y) for t in treatment for y in outcome)
+    graph.add_edges_from((c, v) for c in common_causes for v in treatment + outcome)
+    return graph
+
+
+def validate_graph(graph, treatment, outcome, columns):
+    missing = [v for v in treatment + outcome if v not in graph]
+    if missing:
+        raise ValueError(
+            f"Treatment/outcome not present in the causal graph: {', '.join(missing)}"
+        )
+    not_in_data = [v for v in treatment + outcome if v not in columns]
+    if not_in_data:
+        raise ValueError(
+            f"Treatment/outcome not present in the data: {', '.join(not_in_data)}"
+        )
+
+
+def to_gml(graph):
+    # dowhy matches GML with a single-line regex, so keep it on one line
+    return " ".join(nx.generate_gml(graph))
+
+
+def identification_key(graph_key, treatment, outcome, observed):
+    return (graph_key, tuple(treatment), tuple(outcome), frozenset(observed))
+
+
+def identify_effect(model, key):
+    if key in _identification_cache:
+        _identification_cache.move_to_end(key)
+        return _identification_cache[key]
+    estimand = model.identify_effect(proceed_when_unidentifiable=True)
+    _identification_cache[key] = estimand
+    if len(_identification_cache) > IDENTIFICATION_CACHE_SIZE:
+        _identification_cache.popitem(last=False)
+    return estimand
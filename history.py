@@ -0,0 +1,222 @@
+import argparse
+import difflib
+import hashlib
+import json
+import os
+import sqlite3
+import zlib
+from contextlib import closing
+from datetime import datetime, timezone
+
+DB_PATH = os.getenv("CAUSAL_HISTORY_DB", "history.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    dataset_hash TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    results BLOB NOT NULL,
+    artifacts BLOB NOT NULL
+)
+"""
+
+
+def _connect(db_path=None):
+    conn = sqlite3.connect(db_path or DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute(SCHEMA)
+    return conn
+
+
+def _compress(value):
+    return zlib.compress(json.dumps(value).encode("utf-8"))
+
+
+def _decompress(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def dataset_hash(df):
+    import pandas as pd
+
+    row_hashes = pd.util.hash_pandas_object(df, index=True).values
+    digest = hashlib.sha256(row_hashes.tobytes())
+    digest.update(json.dumps(list(map(str, df.columns))).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def create_run(spec, data_hash, results=None, artifacts=None, db_path=None):
+    """Store a completed analysis as a new run and return its id.
+
+    Re-running the same spec creates another row, so repeated runs (random
+    refuters, LLM explanations) can be diffed against each other.
+    """
+    with closing(_connect(db_path)) as conn, conn:
+        cursor = conn.execute(
+            "INSERT INTO analyses (created_at, updated_at, dataset_hash, spec,"
+            " results, artifacts) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                _now(),
+                _now(),
+                data_hash,
+                json.dumps(spec, sort_keys=True),
+                _compress(results or {}),
+                _compress(artifacts or {}),
+            ),
+        )
+        return cursor.lastrowid
+
+
+def update_run(run_id, results=None, artifacts=None, db_path=None):
+    """Merge results and artifacts from later phases into an existing run.
+
+    Returns the run id.
+    """
+    with closing(_connect(db_path)) as conn, conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT id, results, artifacts FROM analyses WHERE id = ?", (run_id,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(f"No analysis with id {run_id}")
+        merged_results = {**_decompress(row["results"]), **(results or {})}
+        merged_artifacts = {**_decompress(row["artifacts"]), **(artifacts or {})}
+        conn.execute(
+            "UPDATE analyses SET updated_at = ?, results = ?, artifacts = ? WHERE id = ?",
+            (
+                _now(),
+                _compress(merged_results),
+                _compress(merged_artifacts),
+                row["id"],
+            ),
+        )
+        return row["id"]
+
+
+def list_runs(db_path=None):
+    with closing(_connect(db_path)) as conn:
+        rows = conn.execute(
+            "SELECT id, created_at, updated_at, dataset_hash, spec FROM analyses"
+            " ORDER BY updated_at DESC, id DESC"
+        ).fetchall()
+    return [
+        {
+            "id": row["id"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "dataset_hash": row["dataset_hash"],
+            "spec": json.loads(row["spec"]),
+        }
+        for row in rows
+    ]
+
+
+def load_run(run_id, db_path=None):
+    with closing(_connect(db_path)) as conn:
+        row = conn.execute("SELECT * FROM analyses WHERE id = ?", (run_id,)).fetchone()
+    if row is None:
+        raise KeyError(f"No analysis with id {run_id}")
+    return {
+        "id": row["id"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+        "dataset_hash": row["dataset_hash"],
+        "spec": json.loads(row["spec"]),
+        "results": _decompress(row["results"]),
+        "artifacts": _decompress(row["artifacts"]),
+    }
+
+
+def describe(run):
+    spec = run["spec"]
+    return (
+        f"#{run['id']} {run['updated_at']} - "
+        f"{', '.join(spec['treatment'])} -> {', '.join(spec['outcome'])}"
+        f" | confounders: {', '.join(spec['confounders']) or '-'}"
+        f" | graph {spec['graph'][:8]}"
+        f" | data {run['dataset_hash'][:8]}"
+    )
+
+
+def _as_text(value):
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, indent=2, sort_keys=True)
+
+
+def diff_runs(run_a, run_b):
+    """Return a unified text diff of the spec and text results of two runs.
+
+    Artifacts are binary images, so they are only reported as changed.
+    """
+    lines = []
+    sections = [
+        ("data", {"hash": run_a["dataset_hash"]}, {"hash": run_b["dataset_hash"]}),
+        ("spec", run_a["spec"], run_b["spec"]),
+        ("results", run_a["results"], run_b["results"]),
+    ]
+    for section, a, b in sections:
+        for key in sorted(set(a) | set(b)):
+            if key not in b:
+                lines.append(f"{section}.{key} only in #{run_a['id']}")
+                continue
+            if key not in a:
+                lines.append(f"{section}.{key} only in #{run_b['id']}")
+                continue
+            old, new = _as_text(a[key]), _as_text(b[key])
+            if old == new:
+                continue
+            lines.extend(
+                difflib.unified_diff(
+                    old.splitlines(),
+                    new.splitlines(),
+                    fromfile=f"#{run_a['id']} {section}.{key}",
+                    tofile=f"#{run_b['id']} {section}.{key}",
+                    lineterm="",
+                )
+            )
+    artifacts_a, artifacts_b = run_a["artifacts"], run_b["artifacts"]
+    for key in sorted(set(artifacts_a) | set(artifacts_b)):
+        if key not in artifacts_b:
+            lines.append(f"artifacts.{key} only in #{run_a['id']}")
+        elif key not in artifacts_a:
+            lines.append(f"artifacts.{key} only in #{run_b['id']}")
+        elif artifacts_a[key] != artifacts_b[key]:
+            lines.append(f"artifact {key} differs")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Browse saved causal analyses.")
+    parser.add_argument("--db", default=DB_PATH, help="Path to the history database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List saved analyses")
+    show = commands.add_parser("show", help="Print the results of an analysis")
+    show.add_argument("id", type=int)
+    diff = commands.add_parser("diff", help="Diff two analyses")
+    diff.add_argument("a", type=int)
+    diff.add_argument("b", type=int)
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for run in list_runs(args.db):
+            print(describe(run))
+    elif args.command == "show":
+        run = load_run(args.id, args.db)
+        print(describe(run))
+        for key, value in run["results"].items():
+            print(f"\n== {key} ==\n{value}")
+        for key in run["artifacts"]:
+            print(f"\n== {key} == (image)")
+    elif args.command == "diff":
+        print(diff_runs(load_run(args.a, args.db), load_run(args.b, args.db)))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,30 @@ from llm import (
     get_variables_from_metadata,
     explain_identification,
 )
+from causal_graph import (
+    load_graph,
+    graph_from_common_causes,
+    graph_hash,
+    validate_graph,
+    to_gml,
+    identification_key,
+    identify_effect,
+)
+from profiling import (
+    profile_columns,
+    default_var_type,
+    check_variables,
+    check_var_type,
+)
+from history import (
+    dataset_hash,
+    create_run,
+    update_run,
+    list_runs,
+    load_run,
+    describe,
+    diff_runs,
+)
 import dash_dangerously_set_inner_html
 from dash import dcc, html, Output, Input, State, ALL
 import dash_bootstrap_components as dbc
@@ -14,8 +38,10 @@ import pandas as pd
 import logging
 import io
 import base64
+import hashlib
 from dowhy import CausalModel
 import os
+import sqlite3
 import matplotlib.pyplot as plt
 import json
 import matplotlib
@@ -106,6 +132,41 @@ app.layout = dbc.Container(
                                     ]
                                 ),
                             ],
+                            className="mb-3",
+                        ),
+                        dbc.Card(
+                            [
+                                dbc.CardHeader(
+                                    "Causal Graph (optional, DOT or GML)"),
+                                dbc.CardBody(
+                                    [
+                                        dcc.Upload(
+                                            id="upload-graph",
+                                            children=html.Div(
+                                                "Drag and drop or click to select a .dot/.gml file."
+                                            ),
+                                            multiple=False,
+                                        ),
+                                        dcc.Textarea(
+                                            id="graph-input",
+                                            placeholder="digraph { age -> treat; age -> re78; treat -> re78; }",
+                                            value="",
+                                            style={
+                                                "width": "100%",
+                                                "height": "120px",
+                                            },
+                                        ),
+                                        html.Div(id="graph-status"),
+                                        dbc.Button(
+                                            "Apply Graph",
+                                            id="graph-apply",
+                                            n_clicks=0,
+                                            color="primary",
+                                        ),
+                                        dcc.Store(id="applied-graph", data=""),
+                                    ]
+                                ),
+                            ],
                         ),
                     ],
                     width=6,
@@ -144,6 +205,43 @@ app.layout = dbc.Container(
                 ),
             ]
         ),
+        dbc.Row(
+            dbc.Col(
+                dbc.Card(
+                    [
+                        dbc.CardHeader("Analysis History"),
+                        dbc.CardBody(
+                            [
+                                dbc.Button(
+                                    "Refresh",
+                                    id="history-refresh",
+                                    n_clicks=0,
+                                    color="primary",
+                                ),
+                                dcc.Dropdown(
+                                    placeholder="Select a past analysis to reopen...",
+                                    id="history-selector",
+                                ),
+                                dcc.Dropdown(
+                                    placeholder="Select another analysis to diff against...",
+                                    id="history-compare",
+                                ),
+                                html.Div(id="history-view"),
+                                html.Div(id="history-status"),
+                                # Run created by the last completed analysis,
+                                # and later results waiting to be added to it
+                                dcc.Store(id="current-run"),
+                                dcc.Store(id="pending-model", data=[]),
+                                dcc.Store(id="pending-charts", data=[]),
+                                dcc.Store(id="pending-refutations", data=[]),
+                            ]
+                        ),
+                    ],
+                    className="my-3",
+                ),
+                width=12,
+            )
+        ),
     ],
     fluid=True,
 )
@@ -162,6 +260,107 @@ def parse_contents(contents, filename):
     return df
 
 
+def parse_graph_contents(contents):
+    content_type, content_string = contents.split(",")
+    return base64.b64decode(content_string).decode("utf-8")
+
+
+def has_graph(graph_str):
+    return bool(graph_str and graph_str.strip())
+
+
+def analysis_variables(values, graph_str):
+    # Returns the columns and graph the analysis uses. With an applied graph
+    # the dropdown confounders are ignored and identification picks adjustment
+    # sets from the observed graph nodes instead.
+    outcome = values[0]
+    treat = values[1]
+    causes = values[2]
+    if has_graph(graph_str):
+        graph, key = load_graph(graph_str.strip())
+        validate_graph(graph, treat, outcome, list(df.columns))
+        causes = []
+    else:
+        graph = graph_from_common_causes(treat, outcome, causes)
+        key = graph_hash(graph)
+    observed = set(graph.nodes) & set(df.columns)
+    adjustment = causes or sorted(observed - set(treat) - set(outcome))
+    return treat, outcome, causes, adjustment, graph, key
+
+
+def build_model(values, graph_str):
+    # Builds the model from the applied graph when there is one, otherwise
+    # from the dropdowns, and remembers the graph hash for identification.
+    global model, estimand_key, run_spec, analysis_columns, analysis_key
+    treat, outcome, causes, adjustment, graph, key = analysis_variables(
+        values, graph_str)
+    if has_graph(graph_str):
+        model = CausalModel(data=df, treatment=treat,
+                            outcome=outcome, graph=to_gml(graph))
+    else:
+        model = CausalModel(data=df, treatment=treat,
+                            outcome=outcome, common_causes=causes)
+    observed = set(graph.nodes) & set(df.columns)
+    estimand_key = identification_key(key, treat, outcome, observed)
+    analysis_columns = (treat, outcome, adjustment)
+    run_spec = {
+        "treatment": treat,
+        "outcome": outcome,
+        "confounders": causes,
+        "graph": key,
+        "estimator": "backdoor.propensity_score_weighting",
+        "method_params": {"weighting_scheme": "ips_weight"},
+    }
+    # Ties results from the different phases to the analysis they belong to
+    analysis_key = hashlib.sha256(
+        json.dumps({"spec": run_spec, "data": data_hash},
+                   sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return model
+
+
+def save_history(save, *args, **kwargs):
+    # History is best effort, a failed save must not hide the analysis result
+    try:
+        return save(*args, **kwargs)
+    except (sqlite3.Error, KeyError) as e:
+        logger.warning("Could not save analysis history: %s", e)
+        return None
+
+
+def add_pending(pending, key, current_run, name, value):
+    # A result belongs to the run that was current when it was computed, or to
+    # the next run of its analysis if that run did not exist yet. Results of
+    # other analyses are dropped so the store stays small.
+    run = current_run["id"] if current_run and current_run["key"] == key else None
+    items = [
+        item
+        for item in pending or []
+        if item["key"] == key and (item["name"], item["run"]) != (name, run)
+    ]
+    items.append({"key": key, "run": run, "name": name, "value": value})
+    return items
+
+
+def save_pending(run_id, items, results_store):
+    values = {item["name"]: item["value"] for item in items}
+    if results_store:
+        saved = save_history(update_run, run_id, results=values)
+    else:
+        saved = save_history(update_run, run_id, artifacts=values)
+    if saved is None:
+        return html.Div("Could not save to the analysis history.",
+                        style={"color": "red"})
+    return html.Div(f"Saved to analysis #{run_id}")
+
+
+def render_issues(issues):
+    return html.Div(
+        [html.Div(issue) for issue in issues],
+        style={"color": "red"},
+    )
+
+
 def update_question_elements(questions_list):
     return dbc.Card(
         [
@@ -240,6 +439,53 @@ def update_question_elements_callback(n_clicks, metadata):
     return update_question_elements(questions_list)
 
 
+@app.callback(
+    Output("graph-input", "value"),
+    Input("upload-graph", "contents"),
+    prevent_initial_call=True,
+)
+def upload_graph_callback(contents):
+    return parse_graph_contents(contents)
+
+
+@app.callback(
+    Output("applied-graph", "data"),
+    Input("graph-apply", "n_clicks"),
+    State("graph-input", "value"),
+    prevent_initial_call=True,
+)
+def apply_graph_callback(n_clicks, graph_str):
+    # Only a valid graph is applied, graph-status already shows why not
+    if not has_graph(graph_str):
+        return ""
+    try:
+        load_graph(graph_str.strip())
+    except ValueError:
+        return dash.no_update
+    return graph_str.strip()
+
+
+@app.callback(
+    Output("graph-status", "children"),
+    Input("graph-input", "value"),
+    prevent_initial_call=True,
+)
+def validate_graph_callback(graph_str):
+    if not graph_str or not graph_str.strip():
+        return html.Div(
+            "No graph given, the selected confounders will be used after Apply Graph."
+        )
+    try:
+        graph, key = load_graph(graph_str.strip())
+    except Exception as e:
+        return html.Div(f"Invalid graph: {e}", style={"color": "red"})
+    return html.Div(
+        f"Valid DAG with {graph.number_of_nodes()} nodes and "
+        f"{graph.number_of_edges()} edges (hash {key[:12]}), click Apply Graph to use it",
+        style={"color": "green"},
+    )
+
+
 @app.callback(
     Output("variable-dropdown-container", "children"),
     Input("upload-data", "contents"),
@@ -250,8 +496,13 @@ def update_question_elements_callback(n_clicks, metadata):
 )
 def update_variable_dropdown_callback(contents, filename, n_clicks, metadata):
     if contents is not None:
-        global df
-        df = parse_contents(contents, filename)
+        global df, profile, data_hash
+        # Parse, profile and hash once per upload, a metadata submit reuses them
+        if "upload-data.contents" in dash.ctx.triggered_prop_ids:
+            df = parse_contents(contents, filename)
+            if isinstance(df, pd.DataFrame):
+                profile = profile_columns(df)
+                data_hash = dataset_hash(df)
         if isinstance(df, pd.DataFrame) and metadata.strip() != "":
             try:
                 json_metadata = convert_metadata(metadata)
@@ -274,10 +525,16 @@ def update_variable_dropdown_callback(contents, filename, n_clicks, metadata):
         Output("refute-parent", "children"),
     ],
     Input({"type": "variable_dropdowns", "index": ALL}, "value"),
+    Input("applied-graph", "data"),
 )
-def show_estimation_selector(values):
+def show_estimation_selector(values, graph_str):
     if len(values) < 3:
-        return dbc.Card()
+        return dbc.Card(), dbc.Card()
+    try:
+        adjustment = analysis_variables(values, graph_str)[3]
+    except ValueError:
+        return dbc.Card(), dbc.Card()
+    selected = adjustment[0] if adjustment else None
     return (
         dbc.Col(
             [
@@ -287,14 +544,14 @@ def show_estimation_selector(values):
                         dbc.CardBody(
                             [
                                 dcc.Dropdown(
-                                    values[2],
-                                    values[2][0],
+                                    adjustment,
+                                    selected,
                                     placeholder="Select which confounder you want to make an estimation for...",
                                     id="estimation-selector",
                                 ),
                                 dcc.Dropdown(
                                     ["continuous", "discrete"],
-                                    "discrete",
+                                    default_var_type(profile, selected),
                                     placeholder="Select the type of the confounder variable...",
                                     id="estimation-type-selector",
                                 ),
@@ -328,28 +585,45 @@ def show_estimation_selector(values):
 
 
 @app.callback(
-    Output("refutation-results", "value"),
+    Output("estimation-type-selector", "value"),
+    Input("estimation-selector", "value"),
+    prevent_initial_call=True,
+)
+def update_estimation_type(value):
+    return default_var_type(profile, value)
+
+
+@app.callback(
+    Output("refutation-results", "children"),
+    Output("pending-refutations", "data"),
     Input("refutation-selector", "value"),
+    State("current-run", "data"),
+    State("pending-refutations", "data"),
     prevent_initial_call=True,
 )
-def show_refutation(value):
+def show_refutation(value, current_run, pending):
+    # Read the shared model state once, another callback may rebuild it
+    causal_model, key, estimand = model, analysis_key, estimand_key
+    issues = check_variables(profile, *analysis_columns)
+    if issues:
+        return render_issues(issues), dash.no_update
     placebo_type = "permute"
     subset_fraction = 0.9
-    lalonde_identified_estimand = model.identify_effect(
-        proceed_when_unidentifiable=True
-    )
-    lalonde_estimate = model.estimate_effect(
+    lalonde_identified_estimand = identify_effect(causal_model, estimand)
+    lalonde_estimate = causal_model.estimate_effect(
         lalonde_identified_estimand, method_name="backdoor.propensity_score_weighting"
     )
-    return html.Div(
-        str(
-            model.refute_estimate(
-                lalonde_identified_estimand,
-                lalonde_estimate,
-                method_name="random_common_cause",
-            )
+    refutation = str(
+        causal_model.refute_estimate(
+            lalonde_identified_estimand,
+            lalonde_estimate,
+            method_name="random_common_cause",
         )
     )
+    pending = add_pending(
+        pending, key, current_run, "refutation:random_common_cause", refutation
+    )
+    return html.Div(refutation), pending
     if value == "random_common_cause":
         return model.refute_estimate(
             lalonde_identified_estimand,
@@ -382,21 +656,33 @@ plt.show = custom_show
 
 @app.callback(
     Output("estimation-graph", "children"),
+    Output("pending-charts", "data"),
     Input("estimation-selector", "value"),
     Input("estimation-type-selector", "value"),
+    State("current-run", "data"),
+    State("pending-charts", "data"),
     prevent_initial_call=True,
 )
-def show_estimation_plot(value, confounder_type):
+def show_estimation_plot(value, confounder_type, current_run, pending):
     print(value)
-    identified_estimand = model.identify_effect(
-        proceed_when_unidentifiable=True)
-    estimate = model.estimate_effect(
+    # Read the shared model state once, another callback may rebuild it
+    causal_model, key, estimand = model, analysis_key, estimand_key
+    issues = check_variables(profile, *analysis_columns)
+    issues += check_var_type(profile, value, confounder_type)
+    if issues:
+        return render_issues(issues), dash.no_update
+    identified_estimand = identify_effect(causal_model, estimand)
+    estimate = causal_model.estimate_effect(
         identified_estimand,
         method_name="backdoor.propensity_score_weighting",
         target_units="ate",
         method_params={"weighting_scheme": "ips_weight"},
     )
+    image_path = "estimate_chart.png"
     try:
+        # Drop the previous chart so a failed interpret can't show a stale one
+        if os.path.exists(image_path):
+            os.remove(image_path)
         estimate.interpret(
             method_name="confounder_distribution_interpreter",
             var_type=confounder_type,
@@ -404,37 +690,51 @@ def show_estimation_plot(value, confounder_type):
             fig_size=(10, 7),
             font_size=12,
         )
-        image_path = "estimate_chart.png"
         if not os.path.exists(image_path):
             raise FileNotFoundError(
-                f"{image_path} not found. Ensure model.view_model() generates the image correctly."
+                f"{image_path} not found. Ensure estimate.interpret() generates the image correctly."
             )
         with open(image_path, "rb") as image_file:
             encoded_image = base64.b64encode(image_file.read()).decode("utf-8")
-            return html.Img(
-                src=f"data:image/png;base64,{encoded_image}",
-                style={"width": "85%"},
-            )
-    except:
-        return html.Div(
-            "Possible mismatch between confounder and type (discrete/continuous)"
-        )
+    except (ValueError, KeyError, TypeError, OSError) as e:
+        logger.exception("Could not interpret the estimate for %s", value)
+        return render_issues(
+            [f"Could not plot '{value}' as {confounder_type}: {e}"]
+        ), dash.no_update
+    pending = add_pending(
+        pending,
+        key,
+        current_run,
+        f"estimate_chart:{value}:{confounder_type}",
+        encoded_image,
+    )
+    return html.Img(
+        src=f"data:image/png;base64,{encoded_image}",
+        style={"width": "85%"},
+    ), pending
 
 
 @app.callback(
     Output("graph_parent", "children"),
+    Output("pending-model", "data"),
     Input({"type": "variable_dropdowns", "index": ALL}, "value"),
+    Input("applied-graph", "data"),
+    State("current-run", "data"),
     prevent_initial_call=True,
 )
-def show_graph(values):
+def show_graph(values, graph_str, current_run):
     if len(values) < 3:
-        return dbc.Card()
-    outcome = values[0]
-    treat = values[1]
-    causes = values[2]
-    global model
-    model = CausalModel(data=df, treatment=treat,
-                        outcome=outcome, common_causes=causes)
+        return dbc.Card(), dash.no_update
+    try:
+        model = build_model(values, graph_str)
+    except ValueError as e:
+        return dbc.Card(
+            [
+                dbc.CardHeader("Phase 1. Model"),
+                dbc.CardBody(html.Div(str(e), style={"color": "red"})),
+            ]
+        ), dash.no_update
+    key = analysis_key
     model.view_model()
 
     # Ensure the image file is saved before trying to read it
@@ -448,13 +748,22 @@ def show_graph(values):
     with open(image_path, "rb") as image_file:
         encoded_image = base64.b64encode(image_file.read()).decode("utf-8")
 
+    # Kept until the analysis completes, so only applied graphs get a run
+    pending = add_pending([], key, current_run, "causal_model", encoded_image)
+
     # identified_estimand = model.identify_effect(
     #     proceed_when_unidentifiable=True)
+    note = (
+        "Using the applied causal graph, the selected confounders are ignored."
+        if has_graph(graph_str)
+        else ""
+    )
     return dbc.Card(
         [
             dbc.CardHeader("Phase 1. Model"),
             dbc.CardBody(
                 [
+                    html.Div(note),
                     html.Img(
                         src=f"data:image/png;base64,{encoded_image}",
                         style={"width": "85%"},
@@ -462,28 +771,34 @@ def show_graph(values):
                 ]
             ),
         ]
-    )
+    ), pending
 
 
 @app.callback(
     [
         Output("identification-parent", "children"),
         Output("identification-explanation", "children"),
+        Output("current-run", "data"),
     ],
-    [Input({"type": "variable_dropdowns", "index": ALL}, "value")],
+    [
+        Input({"type": "variable_dropdowns", "index": ALL}, "value"),
+        Input("applied-graph", "data"),
+    ],
+    State("metadata-input", "value"),
     prevent_initial_call=True,
 )
-def show_identification_plot(values):
+def show_identification_plot(values, graph_str, metadata):
     if len(values) < 3:
-        return dbc.Card()
-    outcome = values[0]
-    treat = values[1]
-    causes = values[2]
-    global model
-    model = CausalModel(data=df, treatment=treat,
-                        outcome=outcome, common_causes=causes)
-    identified_estimand = model.identify_effect(
-        proceed_when_unidentifiable=True)
+        return dbc.Card(), dbc.Card(), dash.no_update
+    try:
+        model = build_model(values, graph_str)
+    except ValueError as e:
+        return html.Div(str(e), style={"color": "red"}), dbc.Card(), dash.no_update
+    spec, key, estimand = run_spec, analysis_key, estimand_key
+    issues = check_variables(profile, *analysis_columns)
+    if issues:
+        return render_issues(issues), dbc.Card(), dash.no_update
+    identified_estimand = identify_effect(model, estimand)
     estimate = model.estimate_effect(
         identified_estimand,
         method_name="backdoor.propensity_score_weighting",
@@ -500,6 +815,18 @@ def show_identification_plot(values):
     identificationToBeExplained = res.summary().as_text()
     explanationmd = explain_identification(
         identificationToBeExplained, json_metadata)
+    artifacts = {"wls_summary_html": res.summary().as_html()}
+    run_id = save_history(
+        create_run,
+        {**spec, "metadata": metadata},
+        data_hash,
+        results={
+            "estimate": str(estimate.value),
+            "wls_summary": identificationToBeExplained,
+            "explanation": explanationmd,
+        },
+        artifacts=artifacts,
+    )
     return html.Div(
         [
             dash_dangerously_set_inner_html.DangerouslySetInnerHTML(
@@ -511,7 +838,124 @@ def show_identification_plot(values):
             dbc.CardHeader("Simplified explanation of results - "),
             dbc.CardBody([html.Div([dcc.Markdown(explanationmd)])]),
         ]
-    )
+    ), (None if run_id is None else {"id": run_id, "key": key})
+
+
+def render_run(run):
+    # Rebuilds the phases from what was stored, without re-running anything
+    results = run["results"]
+    artifacts = run["artifacts"]
+    children = [html.H5(describe(run))]
+    if "causal_model" in artifacts:
+        children.append(
+            html.Img(
+                src=f"data:image/png;base64,{artifacts['causal_model']}",
+                style={"width": "50%"},
+            )
+        )
+    if "estimate" in results:
+        children.append(html.Div(f"Causal Estimate is {results['estimate']}"))
+    if "wls_summary_html" in artifacts:
+        children.append(
+            dash_dangerously_set_inner_html.DangerouslySetInnerHTML(
+                artifacts["wls_summary_html"]
+            )
+        )
+    if "explanation" in results:
+        children.append(dcc.Markdown(results["explanation"]))
+    for key, encoded_image in artifacts.items():
+        if key.startswith("estimate_chart:"):
+            children.append(html.Div(key.split(":", 1)[1]))
+            children.append(
+                html.Img(
+                    src=f"data:image/png;base64,{encoded_image}",
+                    style={"width": "50%"},
+                )
+            )
+    for key, refutation in results.items():
+        if key.startswith("refutation:"):
+            children.append(html.Div(key.split(":", 1)[1]))
+            children.append(html.Pre(refutation))
+    return html.Div(children)
+
+
+@app.callback(
+    Output("history-status", "children"),
+    Input("current-run", "data"),
+    Input("pending-model", "data"),
+    Input("pending-charts", "data"),
+    Input("pending-refutations", "data"),
+    prevent_initial_call=True,
+)
+def save_pending_results(current_run, model_image, charts, refutations):
+    # Whichever arrives last, the run or a result, saves the result into it
+    triggered = dash.ctx.triggered_id
+    if triggered == "current-run":
+        if current_run is None:
+            return dash.no_update
+        status = dash.no_update
+        stores = ((model_image, False), (charts, False), (refutations, True))
+        for items, results_store in stores:
+            waiting = [
+                item
+                for item in items or []
+                if item["run"] is None and item["key"] == current_run["key"]
+            ]
+            if waiting:
+                status = save_pending(current_run["id"], waiting, results_store)
+        return status
+    items = {
+        "pending-model": model_image,
+        "pending-charts": charts,
+        "pending-refutations": refutations,
+    }[triggered]
+    if not items:
+        return dash.no_update
+    item = items[-1]
+    run_id = item["run"]
+    if run_id is None and current_run and current_run["key"] == item["key"]:
+        run_id = current_run["id"]
+    if run_id is None:
+        # Saved once identification creates the run for this analysis
+        return dash.no_update
+    return save_pending(run_id, [item], triggered == "pending-refutations")
+
+
+@app.callback(
+    Output("history-selector", "options"),
+    Output("history-compare", "options"),
+    Output("history-view", "children", allow_duplicate=True),
+    Input("history-refresh", "n_clicks"),
+    prevent_initial_call="initial_duplicate",
+)
+def update_history_options(n_clicks):
+    try:
+        runs = list_runs()
+    except sqlite3.Error as e:
+        logger.warning("Could not read analysis history: %s", e)
+        return [], [], render_issues([f"Could not read the analysis history: {e}"])
+    options = [{"label": describe(run), "value": run["id"]} for run in runs]
+    return options, options, dash.no_update
+
+
+@app.callback(
+    Output("history-view", "children"),
+    Input("history-selector", "value"),
+    Input("history-compare", "value"),
+    prevent_initial_call=True,
+)
+def show_history(run_id, compare_id):
+    if run_id is None:
+        return html.Div()
+    try:
+        run = load_run(run_id)
+        if compare_id is None:
+            return render_run(run)
+        diff = diff_runs(run, load_run(compare_id))
+    except (sqlite3.Error, KeyError) as e:
+        logger.warning("Could not read analysis history: %s", e)
+        return render_issues([f"Could not open the analysis: {e}"])
+    return html.Pre(diff or "No differences.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,90 @@
+import pandas as pd
+
+# Numeric columns with at most this many distinct values are treated as discrete
+MAX_DISCRETE_VALUES = 10
+
+
+def profile_columns(df):
+    """Profile every column of the dataframe in one vectorized pass."""
+    non_null = df.count()
+    n_unique = df.nunique(dropna=True)
+    numeric = pd.Series(
+        {col: pd.api.types.is_numeric_dtype(dtype) for col, dtype in df.dtypes.items()}
+    )
+    binary = df.isin([0, 1, True, False]).where(df.notna(), True).all() & (n_unique == 2)
+    profile = pd.DataFrame(
+        {
+            "dtype": df.dtypes.astype(str),
+            "n_unique": n_unique,
+            "n_missing": len(df) - non_null,
+            "is_numeric": numeric,
+            "is_binary": binary,
+            "is_constant": n_unique <= 1,
+        }
+    )
+    profile["var_type"] = "continuous"
+    profile.loc[
+        ~profile.is_numeric | (profile.n_unique <= MAX_DISCRETE_VALUES), "var_type"
+    ] = "discrete"
+    return profile
+
+
+def default_var_type(profile, column):
+    if column in profile.index:
+        return profile.at[column, "var_type"]
+    return "discrete"
+
+
+def check_variables(profile, treatment, outcome, confounders):
+    """Return a list of problems with the chosen variables, empty if none."""
+    issues = []
+    chosen = {
+        "Treatment": treatment,
+        "Outcome": outcome,
+        "Confounder": confounders,
+    }
+    for role, columns in chosen.items():
+        for col in columns:
+            if col not in profile.index:
+                issues.append(f"{role} '{col}' is not a column of the data.")
+                continue
+            row = profile.loc[col]
+            if row.is_constant:
+                issues.append(f"{role} '{col}' is constant.")
+            if row.n_missing:
+                issues.append(f"{role} '{col}' has {row.n_missing} missing values.")
+    if len(treatment) != 1:
+        issues.append(
+            "Propensity score weighting needs exactly one treatment column."
+        )
+    for col in treatment:
+        if col in profile.index and not profile.at[col, "is_binary"]:
+            issues.append(
+                f"Treatment '{col}' must be binary (0/1) for propensity score weighting."
+            )
+    for col in outcome:
+        if col in profile.index and not profile.at[col, "is_numeric"]:
+            issues.append(f"Outcome '{col}' must be numeric.")
+    overlap = set(confounders) & set(treatment + outcome)
+    if overlap:
+        issues.append(
+            f"Confounders overlap with treatment/outcome: {', '.join(sorted(overlap))}"
+        )
+    return issues
+
+
+def check_var_type(profile, column, var_type):
+    if column not in profile.index:
+        return []
+    if var_type == "continuous" and not profile.at[column, "is_numeric"]:
+        return [f"Confounder '{column}' is not numeric, use 'discrete'."]
+    n_unique = profile.at[column, "n_unique"]
+    if (
+        var_type == "discrete"
+        and profile.at[column, "is_numeric"]
+        and n_unique > MAX_DISCRETE_VALUES
+    ):
+        return [
+            f"Confounder '{column}' has {n_unique} distinct values, use 'continuous'."
+        ]
+    return []